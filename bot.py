@@ -1,26 +1,42 @@
 import asyncio
+import hashlib
 import logging
 import os
 import sys
 import html
+import io
+import random
 import re
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import aclosing, asynccontextmanager
+from typing import TypeVar
 
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StateType
 from aiohttp import web
+import httpx
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types as genai_types
-from google.genai.errors import APIError
-import redis.asyncio as redis
+from google.genai import _api_client as genai_api_client
+from google.genai.errors import APIError, UnknownApiResponseError
+import orjson
+
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
 
 from config import (
     IMAGE_EDIT_MODELS,
@@ -30,51 +46,129 @@ from config import (
 )
 from texts import TEXTS
 
-# Clean up verbose third-party logger output
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - [%(levelname)s] - %(name)s - %(message)s")
-logging.getLogger("google.genai").setLevel(logging.WARNING)
-logging.getLogger("google.api_core").setLevel(logging.WARNING)
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("httpcore").setLevel(logging.WARNING)
-
 # Load environment variables
 load_dotenv()
 
 # Read main configurations
 config = load_config()
+
+
+class TrimLongArgsFilter(logging.Filter):
+    """Truncates long string arguments (prompts, transcriptions) before they are formatted into log lines"""
+
+    def __init__(self, max_length: int = 200):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple):
+            record.args = tuple(
+                arg[:self.max_length] + "…" if isinstance(arg, str) and len(arg) > self.max_length else arg
+                for arg in record.args
+            )
+        return True
+
+
+# Configure logging (LOG_LEVEL=WARNING sheds per-request info logs in production)
+# and clean up verbose third-party logger output
+logging.basicConfig(level=config.log_level, format="%(asctime)s - [%(levelname)s] - %(name)s - %(message)s")
+for log_handler in logging.getLogger().handlers:
+    log_handler.addFilter(TrimLongArgsFilter())
+logging.getLogger("google.genai").setLevel(logging.WARNING)
+logging.getLogger("google.api_core").setLevel(logging.WARNING)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
+
 TELEGRAM_BOT_TOKEN = config.telegram_bot_token
 GOOGLE_API_KEY = config.google_api_key
 ALLOWED_USERS_ENV = config.allowed_users_env
 WEBHOOK_URL = config.webhook_url
 PORT = config.port
 REDIS_URL = config.redis_url
+GEMINI_MAX_CONCURRENCY = config.gemini_max_concurrency
+USER_MAX_CONCURRENCY = config.user_max_concurrency
+IMAGE_CACHE_SIZE = config.image_cache_size
+IMAGE_CACHE_TTL = config.image_cache_ttl
+GEMINI_HEDGE_DELAY = config.gemini_hedge_delay
+GEMINI_IMAGE_HEDGE_DELAY = config.gemini_image_hedge_delay
+EDIT_PHOTO_MAX_SIDE = config.edit_photo_max_side
+FSM_TTL = config.fsm_ttl
+GEMINI_RETRY_ATTEMPTS = config.gemini_retry_attempts
+GEMINI_RETRY_BASE_DELAY = config.gemini_retry_base_delay
+GEMINI_RETRY_MAX_DELAY = config.gemini_retry_max_delay
+GEMINI_RETRY_JITTER = config.gemini_retry_jitter
+GEMINI_MODEL_RPM = config.gemini_model_rpm
+GEMINI_REQUEST_TIMEOUT = config.gemini_request_timeout
 
-# Build a set of allowed user IDs for white-listing access
-ALLOWED_USERS = set()
-for u in ALLOWED_USERS_ENV.split(","):
-    if u.strip().isdigit():
-        ALLOWED_USERS.add(int(u.strip()))
+# Build an immutable set of allowed user IDs for white-listing access
+ALLOWED_USERS = frozenset(int(u) for u in map(str.strip, ALLOWED_USERS_ENV.split(",")) if u.isdigit())
 
 if not TELEGRAM_BOT_TOKEN or not GOOGLE_API_KEY:
     logging.error("TELEGRAM_BOT_TOKEN or GOOGLE_API_KEY not found in .env")
     sys.exit(1)
 
-# Initialize Aiogram instances with default HTML parsing
-bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+def orjson_dumps(value) -> str:
+    """aiogram expects JSON dumpers to return str, while orjson returns bytes"""
+    return orjson.dumps(value).decode()
+
+# Initialize Aiogram instances with default HTML parsing and orjson-based (de)serialization
+# (one keep-alive connection pool reused by every Telegram API call)
+session = AiohttpSession(limit=100, json_loads=orjson.loads, json_dumps=orjson_dumps)
+# aiogram already caches DNS for an hour; additionally keep idle connections open for a minute instead of
+# aiohttp's 15 s, so replies to sparse traffic reuse a warm TLS connection (AiohttpSession has no public knob)
+session._connector_init["keepalive_timeout"] = 60
+bot = Bot(token=TELEGRAM_BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+# Initialize Google Gemini Client on top of one long-lived HTTP/2 connection pool,
+# so concurrent requests are multiplexed instead of paying a TLS handshake each
+# (the transport also transparently retries failed connection attempts before any request is sent)
+gemini_http_client = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+        retries=2,
+    ),
+)
+def orjson_load_genai_response(cls, response):
+    """orjson drop-in for the SDK's response parser, keeping its error contract"""
+    try:
+        return orjson.loads(response)
+    except orjson.JSONDecodeError as e:
+        raise UnknownApiResponseError(f"Failed to parse response as JSON. Raw response: {response}") from e
 
-# Initialize Google Gemini Client
-gemini_client = genai.Client(api_key=GOOGLE_API_KEY, http_options={"api_version": "v1alpha"})
+# google-genai has no JSON codec option, but every (streamed) response body goes through this one classmethod;
+# base64 image payloads make it the heaviest parse in the bot. Skipped if an SDK update renames the hook.
+if hasattr(getattr(genai_api_client, "HttpResponse", None), "_load_json_from_response"):
+    genai_api_client.HttpResponse._load_json_from_response = classmethod(orjson_load_genai_response)
+
+gemini_client = genai.Client(
+    api_key=GOOGLE_API_KEY,
+    http_options=genai_types.HttpOptions(api_version="v1alpha", httpx_async_client=gemini_http_client),
+)
 
 # ==========================================
 # STATE STORAGE (FSM) INITIALIZATION
 # ==========================================
 if REDIS_URL:
+    # Redis modules are only imported when Redis storage is actually configured
+    import redis.asyncio as redis
+    from aiogram.fsm.storage.redis import RedisStorage
+
     try:
         redis_client = redis.from_url(REDIS_URL, decode_responses=False)
-        storage = RedisStorage(redis=redis_client)
+        # Inactive users expire from Redis instead of accumulating forever (FSM_TTL=0 keeps them)
+        # orjson keeps the stored format plain JSON (existing records stay readable) at a fraction of the cost;
+        # redis-py accepts the bytes it produces as-is
+        storage = RedisStorage(
+            redis=redis_client,
+            state_ttl=FSM_TTL or None,
+            data_ttl=FSM_TTL or None,
+            json_loads=orjson.loads,
+            json_dumps=orjson.dumps,
+        )
         logging.info("Redis successfully connected for FSM storage.")
     except Exception as e:
-        logging.error(f"Error connecting to Redis: {e}")
+        logging.error("Error connecting to Redis: %s", e)
         redis_client = None
         storage = MemoryStorage()
         logging.info("Fallback: Using in-memory FSM storage (Warning: Data clears on restart).")
@@ -95,33 +189,211 @@ class BotStates(StatesGroup):
     WAITING_FOR_PHOTO_TO_EDIT = State()  # Bot expects a photo to edit
     WAITING_FOR_EDIT_PROMPT = State()    # Bot received the photo and is waiting for text instructions on how to edit
 
-# Button text matching lists (used for command routing)
-BTN_GENERATE_LIST = [TEXTS["EN"]["BTN_GENERATE"], TEXTS["RU"]["BTN_GENERATE"]]
-BTN_EDIT_LIST = [TEXTS["EN"]["BTN_EDIT"], TEXTS["RU"]["BTN_EDIT"]]
-BTN_HELP_LIST = [TEXTS["EN"]["BTN_HELP"], TEXTS["RU"]["BTN_HELP"]]
-BTN_PRO_LIST = [TEXTS["EN"]["BTN_PRO"], TEXTS["RU"]["BTN_PRO"]]
-BTN_FLASH_LIST = [TEXTS["EN"]["BTN_FLASH"], TEXTS["RU"]["BTN_FLASH"]]
-BTN_LANG_LIST = [TEXTS["EN"]["BTN_LANG"], TEXTS["RU"]["BTN_LANG"]]
+# Button text matching sets (used for command routing).
+# Built once at import so every filter check is a single hash lookup.
+BTN_GENERATE_TEXTS = frozenset({TEXTS["EN"]["BTN_GENERATE"], TEXTS["RU"]["BTN_GENERATE"]})
+BTN_EDIT_TEXTS = frozenset({TEXTS["EN"]["BTN_EDIT"], TEXTS["RU"]["BTN_EDIT"]})
+BTN_HELP_TEXTS = frozenset({TEXTS["EN"]["BTN_HELP"], TEXTS["RU"]["BTN_HELP"]})
+BTN_PRO_TEXTS = frozenset({TEXTS["EN"]["BTN_PRO"], TEXTS["RU"]["BTN_PRO"]})
+BTN_FLASH_TEXTS = frozenset({TEXTS["EN"]["BTN_FLASH"], TEXTS["RU"]["BTN_FLASH"]})
+BTN_LANG_TEXTS = frozenset({TEXTS["EN"]["BTN_LANG"], TEXTS["RU"]["BTN_LANG"]})
+
+# Language selection buttons
+BTN_LANG_EN = "English 🇬🇧"
+BTN_LANG_RU = "Русский 🇷🇺"
+LANG_OPTION_TEXTS = frozenset({BTN_LANG_EN, BTN_LANG_RU})
+
+class AdmissionController:
+    """
+    Bot-wide limit on in-flight Gemini requests that adapts to upstream pressure:
+    a rate limit halves the limit, at most once per `window` seconds so one burst of 429s (and their retries)
+    counts as a single signal, and after every quiet `window` a successful request doubles it again,
+    up to the configured maximum. Unlike a Semaphore, the limit can be resized while tasks wait.
+    """
+    def __init__(self, max_limit: int, window: float = 10.0):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.window = window
+        self.active = 0
+        self._last_shrink = float("-inf")
+        self._last_change = float("-inf")
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify(1)
+
+    async def on_rate_limited(self):
+        now = time.monotonic()
+        if now - self._last_shrink < self.window:
+            return
+        self.limit = max(1, self.limit // 2)
+        self._last_shrink = self._last_change = now
+        logging.warning("Action: admission_shrink | Limit: %s", self.limit)
+
+    async def on_success(self):
+        now = time.monotonic()
+        if self.limit >= self.max_limit or now - self._last_change < self.window:
+            return
+        async with self._cond:
+            # Re-checked: another success may have grown the limit while this one waited for the lock
+            if now - self._last_change < self.window:
+                return
+            self.limit = min(self.max_limit, self.limit * 2)
+            self._last_change = now
+            self._cond.notify_all()
+        logging.info("Action: admission_grow | Limit: %s", self.limit)
+
+class TokenBucket:
+    """
+    Client-side rate limiter: holds requests back until a token is available, so a burst of users
+    is spread over the quota instead of hitting 429s. Tokens refill at `rate` per second up to `capacity`.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock is held while sleeping so waiters are served in arrival order
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.last = time.monotonic()
+            self.tokens -= 1
+
+# Concurrency gates for Gemini calls: one shared by the whole bot and one per user.
+# Per-user semaphores are dropped as soon as the user has nothing in flight.
+GEMINI_ADMISSION = AdmissionController(GEMINI_MAX_CONCURRENCY)
+USER_SEMAPHORES: dict[int, asyncio.Semaphore] = {}
+USER_SEMAPHORE_REFS: dict[int, int] = {}
+
+# Raw text per outgoing message: leaves headroom under Telegram's 4096 limit for HTML escaping and tags
+MESSAGE_CHUNK_SIZE = 3500
+
+# LRU + TTL cache of generated/edited images: cache key -> (stored_at, image bytes)
+IMAGE_CACHE: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+# Telegram keeps a file_path downloadable for at least an hour: file_id -> (resolved_at, file_path)
+FILE_PATH_CACHE: OrderedDict[str, tuple[float, str]] = OrderedDict()
+FILE_PATH_CACHE_SIZE = 1024
+FILE_PATH_CACHE_TTL = 3000
+# Bot API files are at most 20 MB; aiogram's 30 s default is tight for long voice messages on a slow link
+TELEGRAM_DOWNLOAD_TIMEOUT = 60
+
+# Edit photos are downloaded as soon as they arrive, while the user is still typing the instruction:
+# file_id -> (downloaded_at, bytes), plus the downloads still in progress
+PHOTO_CACHE: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+PHOTO_CACHE_SIZE = 100
+PHOTO_CACHE_TTL = 600
+PHOTO_PREFETCH_TASKS: dict[str, asyncio.Task] = {}
+
+# Transient Gemini errors are retried on the same model before the cascade moves on
+GEMINI_RETRY_CODES = frozenset({429, 503})
+
+# Identical image requests in flight (same cache key), shared by every caller asking for the same result
+IN_FLIGHT_REQUESTS: dict[str, asyncio.Task] = {}
+# Callers still awaiting each shared request; the request is cancelled once nobody is left waiting for it
+IN_FLIGHT_WAITERS: dict[asyncio.Task, int] = {}
+
+# Circuit breaker: a model that just exhausted its retries is skipped by new requests for a short while
+GEMINI_MODEL_COOLDOWN = 30.0
+MODEL_COOLDOWNS: dict[str, float] = {}
+
+# Per-model request quota (GEMINI_MODEL_RPM, disabled when 0); the burst allowance is ten seconds' worth of requests
+MODEL_BUCKETS: dict[str, TokenBucket] = {}
+
+# Telegram shows a chat action for 5 seconds; it is refreshed a little earlier while an image is being made
+CHAT_ACTION_INTERVAL = 4.0
 
 
 # ==========================================
 # UTILITY FUNCTIONS
 # ==========================================
+# Markdown converted to Telegram HTML, compiled once at import: one alternation so the text is scanned once
+MD_TOKEN_RE = re.compile(r'\*\*(.*?)\*\*|`([^`]+)`', re.DOTALL)
+MD_CODE_RE = re.compile(r'`([^`]+)`')
+
 def format_html_response(text: str) -> str:
-    """Utility function: Escapes user text and converts basic Markdown to Telegram HTML tags"""
-    text = html.escape(text, quote=False)
-    text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text, flags=re.DOTALL)
-    text = re.sub(r'`([^`]+)`', r'<code>\1</code>', text)
-    return text
-
-async def get_main_keyboard(state: FSMContext) -> ReplyKeyboardMarkup:
-    """Dynamically build the main keyboard based on language and active mode."""
-    data = await state.get_data()
-    lang = data.get("lang", "EN")
-    current_mode = data.get("mode", "FLASH")
-    
+    """Utility function: Escapes user text and converts basic Markdown to Telegram HTML tags in a single pass"""
+    parts = []
+    pos = 0
+    for match in MD_TOKEN_RE.finditer(text):
+        parts.append(html.escape(text[pos:match.start()], quote=False))
+        bold, code = match.groups()
+        if bold is not None:
+            # Inline code may still appear inside bold text; code spans themselves stay literal
+            parts.append("<b>" + MD_CODE_RE.sub(r'<code>\1</code>', html.escape(bold, quote=False)) + "</b>")
+        else:
+            parts.append("<code>" + html.escape(code, quote=False) + "</code>")
+        pos = match.end()
+    parts.append(html.escape(text[pos:], quote=False))
+    return "".join(parts)
+
+def split_message(text: str, limit: int = MESSAGE_CHUNK_SIZE) -> Iterator[str]:
+    """Splits text into chunks of at most `limit` characters in a single pass, preferring to cut between paragraphs, then lines, then words"""
+    i = 0
+    while i < len(text):
+        j = min(i + limit, len(text))
+        next_i = j
+        if j < len(text):
+            for separator in ("\n\n", "\n", " "):
+                k = text.rfind(separator, i, j)
+                if k > i + limit // 2:
+                    # Cut at the separator and drop it, so no chunk starts with a stray newline or space
+                    j, next_i = k, k + len(separator)
+                    break
+        yield text[i:j]
+        i = next_i
+
+async def save_state(state: FSMContext, new_state: StateType, data: dict) -> None:
+    """Writes FSM state and data together: on Redis storage both go out in a single MULTI/EXEC round-trip"""
+    if redis_client is None:
+        await state.set_state(new_state)
+        await state.set_data(data)
+        return
+
+    state_key = storage.key_builder.build(state.key, "state")
+    data_key = storage.key_builder.build(state.key, "data")
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if new_state is None:
+            pipe.delete(state_key)
+        else:
+            pipe.set(state_key, new_state.state if isinstance(new_state, State) else new_state, ex=storage.state_ttl)
+        if data:
+            pipe.set(data_key, storage.json_dumps(data), ex=storage.data_ttl)
+        else:
+            pipe.delete(data_key)
+        await pipe.execute()
+
+async def load_fsm_data(state: FSMContext) -> dict:
+    """Reads FSM data; on Redis its TTL is refreshed in the same round-trip, so settings only expire for inactive users"""
+    if redis_client is None or not storage.data_ttl:
+        return await state.get_data()
+
+    data_key = storage.key_builder.build(state.key, "data")
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(data_key)
+        pipe.expire(data_key, storage.data_ttl)
+        raw, _ = await pipe.execute()
+    return storage.json_loads(raw) if raw else {}
+
+def build_main_keyboard(lang: str, mode: str) -> ReplyKeyboardMarkup:
+    """Builds the main keyboard for a given language and active mode"""
     t = TEXTS[lang]
-    mode_btn = t["BTN_PRO"] if current_mode == "FLASH" else t["BTN_FLASH"]
+    mode_btn = t["BTN_PRO"] if mode == "FLASH" else t["BTN_FLASH"]
     
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -133,251 +405,565 @@ async def get_main_keyboard(state: FSMContext) -> ReplyKeyboardMarkup:
     )
     return keyboard
 
-def get_lang_keyboard() -> ReplyKeyboardMarkup:
-    """Builds the language selection keyboard"""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="English 🇬🇧"), KeyboardButton(text="Русский 🇷🇺")]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True
-    )
-    return keyboard
+# Keyboards never change at runtime, so every (language, mode) variant is built once at import
+MAIN_KEYBOARDS = {
+    (lang, mode): build_main_keyboard(lang, mode)
+    for lang in TEXTS
+    for mode in ("PRO", "FLASH")
+}
+
+LANG_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=BTN_LANG_EN), KeyboardButton(text=BTN_LANG_RU)]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+
+def cache_get(cache: OrderedDict, key: str, ttl: float):
+    """Returns a value from an LRU + TTL cache if it is still fresh, refreshing its LRU position"""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    stored_at, value = entry
+    if time.monotonic() - stored_at >= ttl:
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return value
+
+def cache_put(cache: OrderedDict, key: str, value, max_size: int) -> None:
+    """Stores a value in an LRU + TTL cache, evicting the least recently used entries above `max_size`"""
+    if max_size <= 0:
+        return
+    cache[key] = (time.monotonic(), value)
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+def pick_photo_size(sizes: list[types.PhotoSize]) -> types.PhotoSize:
+    """
+    Picks the largest Telegram-side rendition whose longest side fits EDIT_PHOTO_MAX_SIDE, so no local re-encoding
+    is needed. Beyond the cap, fewer bytes buy a faster upload at the cost of source resolution in edits;
+    EDIT_PHOTO_MAX_SIDE=0 always uses the original photo.
+    """
+    def area(size: types.PhotoSize) -> int:
+        return size.width * size.height
+
+    if EDIT_PHOTO_MAX_SIDE <= 0:
+        return max(sizes, key=area)
+    fitting = [size for size in sizes if max(size.width, size.height) <= EDIT_PHOTO_MAX_SIDE]
+    if fitting:
+        return max(fitting, key=area)
+    # Every rendition is above the cap: take the one closest to it rather than Telegram's smallest thumbnail
+    return min(sizes, key=area)
+
+async def resolve_file_path(bot: Bot, file_id: str) -> str:
+    """Returns the download path of a Telegram file, skipping the get_file round-trip while a cached path is fresh"""
+    file_path = cache_get(FILE_PATH_CACHE, file_id, FILE_PATH_CACHE_TTL)
+    if file_path is None:
+        file_path = (await bot.get_file(file_id)).file_path
+        cache_put(FILE_PATH_CACHE, file_id, file_path, FILE_PATH_CACHE_SIZE)
+    return file_path
+
+async def download_telegram_file(bot: Bot, file_id: str) -> bytes:
+    """Downloads a Telegram file into a single in-memory buffer and returns its contents without an extra read() copy"""
+    file_path = await resolve_file_path(bot, file_id)
+    buffer = io.BytesIO()
+    await bot.download_file(file_path, destination=buffer, timeout=TELEGRAM_DOWNLOAD_TIMEOUT)
+    return buffer.getvalue()
+
+async def prefetch_photo(bot: Bot, file_id: str) -> bytes | None:
+    """Downloads an edit photo into PHOTO_CACHE in the background; failures are left to the on-demand download"""
+    try:
+        data = await download_telegram_file(bot, file_id)
+        cache_put(PHOTO_CACHE, file_id, data, PHOTO_CACHE_SIZE)
+        return data
+    except Exception as e:
+        logging.warning("Action: photo_prefetch_failed | FileID: %s | Error: %s", file_id, e)
+        return None
+    finally:
+        PHOTO_PREFETCH_TASKS.pop(file_id, None)
+
+def start_photo_prefetch(bot: Bot, file_id: str) -> None:
+    """Starts downloading a photo ahead of time unless it is already cached or being downloaded"""
+    if file_id in PHOTO_PREFETCH_TASKS or cache_get(PHOTO_CACHE, file_id, PHOTO_CACHE_TTL) is not None:
+        return
+    PHOTO_PREFETCH_TASKS[file_id] = asyncio.create_task(prefetch_photo(bot, file_id))
+
+async def get_edit_photo(bot: Bot, file_id: str) -> bytes:
+    """Returns the edit photo bytes: from the prefetch cache, by joining a running prefetch, or by downloading now"""
+    data = cache_get(PHOTO_CACHE, file_id, PHOTO_CACHE_TTL)
+    if data is None and file_id in PHOTO_PREFETCH_TASKS:
+        # Shielded so a cancelled request does not abort a download another request may still join
+        data = await asyncio.shield(PHOTO_PREFETCH_TASKS[file_id])
+    if data is None:
+        data = await download_telegram_file(bot, file_id)
+    return data
+
+def get_main_keyboard(lang: str, mode: str) -> ReplyKeyboardMarkup:
+    """Returns the prebuilt main keyboard matching the user's language and active mode"""
+    return MAIN_KEYBOARDS[(lang, mode)]
+
+
+@asynccontextmanager
+async def gemini_slot(user_id: int):
+    """Limits in-flight Gemini requests globally and per user to avoid 429 storms and memory spikes"""
+    user_sem = USER_SEMAPHORES.get(user_id)
+    if user_sem is None:
+        user_sem = USER_SEMAPHORES[user_id] = asyncio.Semaphore(USER_MAX_CONCURRENCY)
+    USER_SEMAPHORE_REFS[user_id] = USER_SEMAPHORE_REFS.get(user_id, 0) + 1
+    try:
+        async with user_sem, GEMINI_ADMISSION:
+            yield
+    finally:
+        USER_SEMAPHORE_REFS[user_id] -= 1
+        if not USER_SEMAPHORE_REFS[user_id]:
+            del USER_SEMAPHORE_REFS[user_id]
+            del USER_SEMAPHORES[user_id]
 
 
 # ==========================================
-# MIDDLEWARES
+# ACCESS CONTROL & MIDDLEWARES
 # ==========================================
-@dp.message.outer_middleware()
-async def access_control_middleware(handler, event: Message, data: dict):
-    """Access Blocker: Filters out messages from users not listed in the ALLOWED_USERS whitelist"""
-    if ALLOWED_USERS and event.from_user.id not in ALLOWED_USERS:
-        logging.warning(f"Action: access_denied | UserID: {event.from_user.id} | Reason: not_in_whitelist")
-        return
+async def access_control_middleware(handler, event: types.Update, data: dict):
+    """Access Blocker: Drops updates from users not listed in the ALLOWED_USERS whitelist"""
+    # aiogram resolves the sender once per update; it is None for updates without one (e.g. anonymous posts)
+    event_from_user = data.get("event_from_user")
+    user_id = event_from_user.id if event_from_user is not None else None
+    if user_id in ALLOWED_USERS:
+        return await handler(event, data)
+    logging.warning("Action: access_denied | UserID: %s | Reason: not_in_whitelist", user_id)
+    return None
+
+# Placed right after aiogram's user context middleware and before the FSM one, so a rejected update
+# costs no state lookup (a Redis round-trip with RedisStorage), routing or filter work
+if ALLOWED_USERS:
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(access_control_middleware)
+    dp.update.outer_middleware(dp.fsm)
+
+@dp.message.middleware()
+async def user_settings_middleware(handler, event: Message, data: dict):
+    """Loads FSM data once per update and injects it, plus the user's language and mode, into handlers"""
+    # Most flows only change the state key, so reading the data is also what keeps lang/mode from expiring
+    fsm_data = await load_fsm_data(data["state"])
+    data["fsm_data"] = fsm_data
+    data["lang"] = fsm_data.get("lang", "EN")
+    data["mode"] = fsm_data.get("mode", "FLASH")
     return await handler(event, data)
 
 
 # ==========================================
 # LANGUAGE SELECTION HANDLERS
 # ==========================================
-@dp.message(F.text.in_(BTN_LANG_LIST))
-async def command_change_lang(message: Message, state: FSMContext):
+@dp.message(F.text.in_(BTN_LANG_TEXTS))
+async def command_change_lang(message: Message, state: FSMContext, lang: str):
     """Triggered when the user wants to change their language"""
     await state.set_state(BotStates.WAITING_FOR_LANGUAGE)
-    
-    data = await state.get_data()
-    lang = data.get("lang", "EN")
     t = TEXTS[lang]
     
-    await message.answer(t["CHOOSE_LANG"], reply_markup=get_lang_keyboard())
+    await message.answer(t["CHOOSE_LANG"], reply_markup=LANG_KEYBOARD)
 
-@dp.message(BotStates.WAITING_FOR_LANGUAGE, F.text.in_(["English 🇬🇧", "Русский 🇷🇺"]))
-async def handle_language_selection(message: Message, state: FSMContext):
+@dp.message(BotStates.WAITING_FOR_LANGUAGE, F.text.in_(LANG_OPTION_TEXTS))
+async def handle_language_selection(message: Message, state: FSMContext, fsm_data: dict):
     """Saves the chosen language to state and shows the main menu"""
-    lang = "EN" if "English" in message.text else "RU"
-    await state.update_data(lang=lang)
-    await state.set_state(None)
+    lang = "EN" if message.text == BTN_LANG_EN else "RU"
+    fsm_data["lang"] = lang
+    await save_state(state, None, fsm_data)
     
     t = TEXTS[lang]
-    kb = await get_main_keyboard(state)
+    kb = get_main_keyboard(lang, fsm_data.get("mode", "FLASH"))
     await message.answer(t["LANG_SET"], reply_markup=kb)
     await message.answer(t["WELCOME"], reply_markup=kb)
 
 @dp.message(BotStates.WAITING_FOR_LANGUAGE)
 async def handle_invalid_language(message: Message, state: FSMContext):
     """Fallback if user types something invalid during language selection"""
-    await message.answer("Please choose a language from the keyboard below.\nПожалуйста, выберите язык на клавиатуре ниже.", reply_markup=get_lang_keyboard())
+    await message.answer("Please choose a language from the keyboard below.\nПожалуйста, выберите язык на клавиатуре ниже.", reply_markup=LANG_KEYBOARD)
 
 
 # ==========================================
 # COMMAND & BUTTON HANDLERS
 # ==========================================
 @dp.message(CommandStart())
-async def command_start(message: Message, state: FSMContext):
+async def command_start(message: Message, state: FSMContext, fsm_data: dict):
     """Entry point: Reset FSM, default to FLASH, and ask for language if not set"""
-    data = await state.get_data()
-    lang = data.get("lang")
-    
-    await state.clear()
-    await state.update_data(mode="FLASH")
-    logging.info(f"Action: command_start | UserID: {message.from_user.id}")
+    lang = fsm_data.get("lang")
+    logging.info("Action: command_start | UserID: %s", message.from_user.id)
     
     if not lang:
-        await state.set_state(BotStates.WAITING_FOR_LANGUAGE)
-        await message.answer(TEXTS["EN"]["CHOOSE_LANG"], reply_markup=get_lang_keyboard())
+        await save_state(state, BotStates.WAITING_FOR_LANGUAGE, {"mode": "FLASH"})
+        await message.answer(TEXTS["EN"]["CHOOSE_LANG"], reply_markup=LANG_KEYBOARD)
     else:
-        # User already has a language, just show the welcome text
-        await state.update_data(lang=lang)
+        # User already has a language: keep it, reset everything else and show the welcome text
+        await save_state(state, None, {"mode": "FLASH", "lang": lang})
         t = TEXTS[lang]
-        kb = await get_main_keyboard(state)
+        kb = get_main_keyboard(lang, "FLASH")
         await message.answer(t["WELCOME"], reply_markup=kb)
 
-@dp.message(F.text.in_(BTN_GENERATE_LIST))
-async def handle_generate_image_command(message: Message, state: FSMContext):
+async def handle_generate_image_command(message: Message, state: FSMContext, fsm_data: dict, lang: str, mode: str):
     """Initiate the image generation process"""
     await state.set_state(BotStates.WAITING_FOR_IMAGE_PROMPT)
-    logging.info(f"Action: command_generate_image | UserID: {message.from_user.id}")
+    logging.info("Action: command_generate_image | UserID: %s", message.from_user.id)
     
-    data = await state.get_data()
-    t = TEXTS[data.get("lang", "EN")]
+    t = TEXTS[lang]
     
-    kb = await get_main_keyboard(state)
+    kb = get_main_keyboard(lang, mode)
     await message.answer(t["GENERATE_PROMPT"], reply_markup=kb)
 
-@dp.message(F.text.in_(BTN_EDIT_LIST))
-async def handle_edit_image_command(message: Message, state: FSMContext):
+async def handle_edit_image_command(message: Message, state: FSMContext, fsm_data: dict, lang: str, mode: str):
     """Initiate the photo editing process"""
     await state.set_state(BotStates.WAITING_FOR_PHOTO_TO_EDIT)
-    logging.info(f"Action: command_edit_image | UserID: {message.from_user.id}")
+    logging.info("Action: command_edit_image | UserID: %s", message.from_user.id)
     
-    data = await state.get_data()
-    t = TEXTS[data.get("lang", "EN")]
+    t = TEXTS[lang]
     
-    kb = await get_main_keyboard(state)
+    kb = get_main_keyboard(lang, mode)
     await message.answer(t["EDIT_PROMPT"], reply_markup=kb)
 
-@dp.message(F.text.in_(BTN_HELP_LIST))
-async def command_help(message: Message, state: FSMContext):
+async def command_help(message: Message, state: FSMContext, fsm_data: dict, lang: str, mode: str):
     """Display quick reference information about the bot"""
     await state.set_state(None)
-    logging.info(f"Action: command_help | UserID: {message.from_user.id}")
+    logging.info("Action: command_help | UserID: %s", message.from_user.id)
     
-    data = await state.get_data()
-    t = TEXTS[data.get("lang", "EN")]
+    t = TEXTS[lang]
     
-    kb = await get_main_keyboard(state)
+    kb = get_main_keyboard(lang, mode)
     await message.answer(t["HELP_TEXT"], reply_markup=kb)
 
-@dp.message(F.text.in_(BTN_PRO_LIST))
-async def command_mode_pro(message: Message, state: FSMContext):
+async def command_mode_pro(message: Message, state: FSMContext, fsm_data: dict, lang: str, mode: str):
     """Switch to PRO Mode: Activates heavier Gemini models"""
-    await state.update_data(mode="PRO")
-    logging.info(f"Action: mode_switch | UserID: {message.from_user.id} | Mode: PRO")
+    fsm_data["mode"] = "PRO"
+    await state.set_data(fsm_data)
+    logging.info("Action: mode_switch | UserID: %s | Mode: PRO", message.from_user.id)
     
-    data = await state.get_data()
-    t = TEXTS[data.get("lang", "EN")]
+    t = TEXTS[lang]
     
-    kb = await get_main_keyboard(state)
+    kb = get_main_keyboard(lang, "PRO")
     await message.answer(t["PRO_ACTIVATED"], reply_markup=kb)
 
-@dp.message(F.text.in_(BTN_FLASH_LIST))
-async def command_mode_flash(message: Message, state: FSMContext):
+async def command_mode_flash(message: Message, state: FSMContext, fsm_data: dict, lang: str, mode: str):
     """Switch to FLASH Mode: Activates lightweight and rapid models"""
-    await state.update_data(mode="FLASH")
-    logging.info(f"Action: mode_switch | UserID: {message.from_user.id} | Mode: FLASH")
+    fsm_data["mode"] = "FLASH"
+    await state.set_data(fsm_data)
+    logging.info("Action: mode_switch | UserID: %s | Mode: FLASH", message.from_user.id)
     
-    data = await state.get_data()
-    t = TEXTS[data.get("lang", "EN")]
+    t = TEXTS[lang]
     
-    kb = await get_main_keyboard(state)
+    kb = get_main_keyboard(lang, "FLASH")
     await message.answer(t["FLASH_ACTIVATED"], reply_markup=kb)
 
+# Main menu button label (in every language) -> handler, resolved with one dict lookup per message
+BUTTON_HANDLERS: dict[str, Callable[[Message, FSMContext, dict, str, str], Awaitable[None]]] = {
+    label: handler
+    for labels, handler in (
+        (BTN_GENERATE_TEXTS, handle_generate_image_command),
+        (BTN_EDIT_TEXTS, handle_edit_image_command),
+        (BTN_HELP_TEXTS, command_help),
+        (BTN_PRO_TEXTS, command_mode_pro),
+        (BTN_FLASH_TEXTS, command_mode_flash),
+    )
+    for label in labels
+}
+
+# The filter itself resolves the handler (one dict.get per message) and injects it as `button_handler`
+@dp.message(F.text.func(BUTTON_HANDLERS.get).as_("button_handler"))
+async def dispatch_menu_button(message: Message, state: FSMContext, fsm_data: dict, lang: str, mode: str, button_handler: Callable[..., Awaitable[None]]):
+    """Routes main menu button presses through a single registered handler instead of one filter per button"""
+    await button_handler(message, state, fsm_data, lang, mode)
+
 
 # ==========================================
 # GEMINI API INTERACTION
 # ==========================================
-async def handle_genai_error(e: APIError, status_msg: Message, lang: str):
+async def report_status(status_msg: Message | None, text: str):
+    """Shows an error in the status message; there is none when Telegram refused to send it, and then nothing is shown"""
+    if status_msg is None:
+        return
+    try:
+        await status_msg.edit_text(text)
+    except Exception as e:
+        # Reporting is the last step of a failed request: a Telegram error here must not escape to aiogram
+        logging.warning("Action: status_report_failed | ChatID: %s | Error: %s", status_msg.chat.id, e)
+
+async def handle_genai_error(e: APIError, status_msg: Message | None, lang: str):
     """Handles common Gemini API errors and updates the status message for the user"""
     t = TEXTS[lang]
     if e.code == 400:
-        await status_msg.edit_text(t["ERR_SAFETY"])
+        await report_status(status_msg, t["ERR_SAFETY"])
     elif e.code == 429:
-        await status_msg.edit_text(t["ERR_RATELIMIT"])
+        await report_status(status_msg, t["ERR_RATELIMIT"])
     elif e.code >= 500:
-        await status_msg.edit_text(t["ERR_SERVER"])
+        await report_status(status_msg, t["ERR_SERVER"])
     else:
-        await status_msg.edit_text(t["ERR_UNKNOWN"].format(error=e.message))
+        # API error text is arbitrary and must be escaped, or a stray "<" makes Telegram reject the HTML message
+        await report_status(status_msg, t["ERR_UNKNOWN"].format(error=html.escape(str(e.message or e.code), quote=False)))
 
-async def generate_image_from_text(prompt: str, mode: str, status_msg: Message, lang: str) -> bytes | None:
-    """Generates an image from scratch based on a text prompt"""
-    model_name = IMAGE_GEN_MODELS.get(mode, IMAGE_GEN_MODELS["FLASH"])[0]
-    logging.info(f"Action: api_call | Type: generate_image | Model: {model_name}")
-    t = TEXTS[lang]
+def image_cache_key(user_id: int, model_name: str, prompt: str, image_bytes: bytes | None = None) -> str:
+    """Builds a deterministic cache key from the user, the model, the prompt and (for edits) the source image"""
+    # Scoped per user: one user's image must never be served to someone else typing the same prompt
+    digest = hashlib.sha256(str(user_id).encode())
+    digest.update(b"\0")
+    digest.update(model_name.encode())
+    digest.update(b"\0")
+    digest.update(prompt.encode())
+    if image_bytes is not None:
+        digest.update(b"\0")
+        digest.update(image_bytes)
+    return digest.hexdigest()
+
+def get_cached_image(key: str) -> bytes | None:
+    """Returns a cached generated/edited image if it is still fresh"""
+    return cache_get(IMAGE_CACHE, key, IMAGE_CACHE_TTL)
+
+def store_cached_image(key: str, data: bytes) -> None:
+    """Stores a generated/edited image, evicting the least recently used entries above IMAGE_CACHE_SIZE"""
+    cache_put(IMAGE_CACHE, key, data, IMAGE_CACHE_SIZE)
+
+def extract_image_bytes(response: genai_types.GenerateContentResponse) -> bytes | None:
+    """Returns the first inline image found in a Gemini response (or response chunk)"""
+    # Every field below is part of the response schema (possibly None), so plain attribute access is enough
+    for candidate in response.candidates or ():
+        content = candidate.content
+        if content is None:
+            continue
+        for part in content.parts or ():
+            if part.inline_data is not None and part.inline_data.data:
+                return part.inline_data.data
+    return None
+
+# Built once and shared by every image request: only the image part is needed, so text output is not requested
+IMAGE_CONFIG = genai_types.GenerateContentConfig(response_modalities=["IMAGE"])
+# Transcription is plain speech-to-text and needs little reasoning; low thinking keeps the voice round-trip short
+TRANSCRIBE_CONFIG = genai_types.GenerateContentConfig(
+    thinking_config=genai_types.ThinkingConfig(thinking_level=genai_types.ThinkingLevel.LOW),
+)
+# The transcription instruction is constant per language, so its Part is built once instead of per voice message
+TRANSCRIBE_PROMPTS = {
+    "EN": genai_types.Part(text="Transcribe this voice message to text. Only return the recognized text without any extra words."),
+    "RU": genai_types.Part(text="Транскрибируй это голосовое сообщение в текст. Выведи только распознанный текст без лишних слов."),
+}
+
+async def stream_first_image(model_name: str, contents: list) -> bytes | None:
+    """Streams the Gemini response and returns the image as soon as its part arrives, without waiting for trailing chunks"""
+    stream = await gemini_client.aio.models.generate_content_stream(model=model_name, contents=contents, config=IMAGE_CONFIG)
+    async with aclosing(stream):
+        async for chunk in stream:
+            data = extract_image_bytes(chunk)
+            if data:
+                return data
+    return None
+
+T = TypeVar("T")
+
+def retry_delay(e: APIError, attempt: int) -> float:
+    """Returns how long to wait before retrying: the server's Retry-After if given, otherwise exponential backoff with jitter"""
+    retry_after = e.response.headers.get("retry-after") if e.response is not None else None
     try:
-        response = await gemini_client.aio.models.generate_content(
-            model=model_name,
-            contents=[prompt]
-        )
-        if response.candidates:
-            for candidate in response.candidates:
-                if candidate.content and candidate.content.parts:
-                    for part in candidate.content.parts:
-                        inline_data = getattr(part, 'inline_data', None)
-                        if inline_data:
-                            data = getattr(inline_data, 'data', None)
-                            if data:
-                                return data
-        return None
-    except APIError as e:
-        logging.error(f"Action: api_error | Type: generate_image | Model: {model_name} | Error: {e.message}")
-        await handle_genai_error(e, status_msg, lang)
-        return None
-    except Exception as e:
-        logging.error(f"Action: system_error | Type: generate_image | Model: {model_name} | Error: {e}")
-        await status_msg.edit_text(t["ERR_GEN_INTERNAL"])
-        return None
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = GEMINI_RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, GEMINI_RETRY_JITTER)
+    return min(delay, GEMINI_RETRY_MAX_DELAY)
+
+async def call_with_retry(request_type: str, model_name: str, call: Callable[[str], Awaitable[T]]) -> T:
+    """Runs `call(model)`, retrying on 429/503 with backoff so a transient rate limit does not downgrade the model"""
+    for attempt in range(GEMINI_RETRY_ATTEMPTS):
+        if GEMINI_MODEL_RPM > 0:
+            bucket = MODEL_BUCKETS.get(model_name)
+            if bucket is None:
+                rate = GEMINI_MODEL_RPM / 60
+                bucket = MODEL_BUCKETS[model_name] = TokenBucket(rate, max(1.0, rate * 10))
+            await bucket.acquire()
+        try:
+            result = await call(model_name)
+            await GEMINI_ADMISSION.on_success()
+            return result
+        except APIError as e:
+            if e.code == 429:
+                await GEMINI_ADMISSION.on_rate_limited()
+            if e.code not in GEMINI_RETRY_CODES or attempt == GEMINI_RETRY_ATTEMPTS - 1:
+                raise
+            delay = retry_delay(e, attempt)
+            logging.warning("Action: api_retry | Type: %s | Model: %s | Error: %s | Delay: %.2fs", request_type, model_name, e.code, delay)
+            await asyncio.sleep(delay)
+
+async def generate_with_fallback(
+    request_type: str,
+    models: tuple[str, ...],
+    call: Callable[[str], Awaitable[T]],
+    hedge_delay: float | None = None,
+) -> T:
+    """
+    Runs `call(model)` over the model cascade: the next model is started when the previous one
+    has exhausted its retries on a retryable error (429/5xx).
+    With `hedge_delay` set, requests are also staggered speculatively: the next model is started
+    when the previous one has not answered within `hedge_delay` seconds. This doubles backend cost
+    on slow requests, so it is opt-in for cheap calls only.
+    The first successful result wins and the remaining requests are cancelled.
+    """
+    # Skip models whose circuit is open, unless every model in the cascade is cooling down
+    now = time.monotonic()
+    remaining = [model for model in models if MODEL_COOLDOWNS.get(model, 0) <= now] or list(models)
+    in_flight: dict[asyncio.Task, str] = {}
+    last_error: APIError | None = None
+    try:
+        while True:
+            if remaining:
+                model_name = remaining.pop(0)
+                logging.info("Action: api_call | Type: %s | Model: %s", request_type, model_name)
+                in_flight[asyncio.create_task(call_with_retry(request_type, model_name, call))] = model_name
+            if not in_flight:
+                break
+
+            done, _ = await asyncio.wait(
+                in_flight,
+                timeout=hedge_delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                model_name = in_flight.pop(task)
+                try:
+                    result = task.result()
+                except APIError as e:
+                    if e.code != 429 and e.code < 500:
+                        raise
+                    logging.warning("Action: api_fallback | Type: %s | Model: %s | Error: %s", request_type, model_name, e.code)
+                    MODEL_COOLDOWNS[model_name] = time.monotonic() + GEMINI_MODEL_COOLDOWN
+                    last_error = e
+                else:
+                    MODEL_COOLDOWNS.pop(model_name, None)
+                    return result
+        raise last_error
+    finally:
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+def release_in_flight(key: str, task: asyncio.Task) -> None:
+    """Unregisters a shared request, unless the key has already been taken over by a newer one"""
+    if IN_FLIGHT_REQUESTS.get(key) is task:
+        del IN_FLIGHT_REQUESTS[key]
+
+async def single_flight(key: str, call: Callable[[], Awaitable[T]]) -> T:
+    """Runs `call()` at most once per key at a time: identical concurrent requests await the first one's result"""
+    task = IN_FLIGHT_REQUESTS.get(key)
+    if task is None:
+        task = IN_FLIGHT_REQUESTS[key] = asyncio.create_task(call())
+        task.add_done_callback(lambda done: release_in_flight(key, done))
+    else:
+        logging.info("Action: single_flight_join | Key: %s", key[:12])
+    IN_FLIGHT_WAITERS[task] = IN_FLIGHT_WAITERS.get(task, 0) + 1
+    try:
+        # Shielded so one caller giving up does not cancel the request for the others
+        return await asyncio.shield(task)
+    finally:
+        IN_FLIGHT_WAITERS[task] -= 1
+        if not IN_FLIGHT_WAITERS[task]:
+            del IN_FLIGHT_WAITERS[task]
+            # The last caller is gone (cancelled or timed out), so a still running request would only be billed.
+            # It is unregistered first: a retry of the same request must start afresh, not join the cancelled task
+            release_in_flight(key, task)
+            task.cancel()
+
+async def run_image_request(
+    user_id: int,
+    request_type: str,
+    models: tuple[str, ...],
+    prompt: str,
+    contents: list,
+    status: Awaitable[Message | None],
+    lang: str,
+    internal_error_key: str,
+    image_bytes: bytes | None = None,
+) -> bytes | None:
+    """
+    Shared path of image generation and editing: cache lookup, single-flight model cascade, caching
+    of the result and error reporting. `status` resolves to the status message shown on errors.
+    """
+    cache_key = image_cache_key(user_id, ",".join(models), prompt, image_bytes)
+    cached = get_cached_image(cache_key)
+    if cached:
+        logging.info("Action: cache_hit | Type: %s | Models: %s", request_type, models)
+        return cached
 
-async def edit_image_with_prompt(image_bytes: bytes, prompt: str, mode: str, status_msg: Message, lang: str) -> bytes | None:
-    """Edits an existing image strictly according to the user's prompt"""
-    model_name = IMAGE_EDIT_MODELS.get(mode, IMAGE_EDIT_MODELS["FLASH"])[0]
-    logging.info(f"Action: api_call | Type: edit_image | Model: {model_name}")
-    t = TEXTS[lang]
     try:
-        contents = [
-            genai_types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"),
-            prompt
-        ]
-        response = await gemini_client.aio.models.generate_content(
-            model=model_name,
-            contents=contents
+        data = await asyncio.wait_for(
+            single_flight(cache_key, lambda: generate_with_fallback(
+                request_type,
+                models,
+                lambda model_name: stream_first_image(model_name, contents),
+                # Off unless configured: racing image models trades backend cost for latency
+                hedge_delay=GEMINI_IMAGE_HEDGE_DELAY,
+            )),
+            GEMINI_REQUEST_TIMEOUT,
         )
-        if response.candidates:
-            for candidate in response.candidates:
-                if candidate.content and candidate.content.parts:
-                    for part in candidate.content.parts:
-                        inline_data = getattr(part, 'inline_data', None)
-                        if inline_data:
-                            data = getattr(inline_data, 'data', None)
-                            if data:
-                                return data
-        return None
+        if data:
+            store_cached_image(cache_key, data)
+        return data
     except APIError as e:
-        logging.error(f"Action: api_error | Type: edit_image | Model: {model_name} | Error: {e.message}")
-        await handle_genai_error(e, status_msg, lang)
+        logging.error("Action: api_error | Type: %s | Models: %s | Error: %s", request_type, models, e.message)
+        await handle_genai_error(e, await status, lang)
+        return None
+    except asyncio.TimeoutError:
+        logging.error("Action: api_timeout | Type: %s | Models: %s | Timeout: %ss", request_type, models, GEMINI_REQUEST_TIMEOUT)
+        await report_status(await status, TEXTS[lang][internal_error_key])
         return None
     except Exception as e:
-        logging.error(f"Action: system_error | Type: edit_image | Model: {model_name} | Error: {e}")
-        await status_msg.edit_text(t["ERR_EDIT_INTERNAL"])
+        logging.error("Action: system_error | Type: %s | Models: %s | Error: %s", request_type, models, e)
+        await report_status(await status, TEXTS[lang][internal_error_key])
         return None
 
+async def generate_image_from_text(user_id: int, prompt: str, mode: str, status: Awaitable[Message | None], lang: str) -> bytes | None:
+    """Generates an image from scratch based on a text prompt"""
+    models = IMAGE_GEN_MODELS.get(mode, IMAGE_GEN_MODELS["FLASH"])
+    return await run_image_request(user_id, "generate_image", models, prompt, [prompt], status, lang, "ERR_GEN_INTERNAL")
+
+async def edit_image_with_prompt(user_id: int, image_bytes: bytes, prompt: str, mode: str, status: Awaitable[Message | None], lang: str) -> bytes | None:
+    """Edits an existing image strictly according to the user's prompt"""
+    models = IMAGE_EDIT_MODELS.get(mode, IMAGE_EDIT_MODELS["FLASH"])
+    contents = [
+        genai_types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"),
+        prompt
+    ]
+    return await run_image_request(
+        user_id, "edit_image", models, prompt, contents, status, lang, "ERR_EDIT_INTERNAL", image_bytes=image_bytes
+    )
+
 async def transcribe_audio(audio_bytes: bytes, mode: str, status_msg: Message, lang: str) -> str | None:
     """Converts a voice message into text using Gemini text/audio models"""
-    model_name = TEXT_AUDIO_MODELS.get(mode, TEXT_AUDIO_MODELS["FLASH"])[0]
-    logging.info(f"Action: api_call | Type: transcribe_audio | Model: {model_name}")
+    models = TEXT_AUDIO_MODELS.get(mode, TEXT_AUDIO_MODELS["FLASH"])
     t = TEXTS[lang]
-    
-    prompt_lang = "Transcribe this voice message to text. Only return the recognized text without any extra words."
-    if lang == "RU":
-        prompt_lang = "Транскрибируй это голосовое сообщение в текст. Выведи только распознанный текст без лишних слов."
-        
+
     contents = [
         genai_types.Part.from_bytes(data=audio_bytes, mime_type='audio/ogg'),
-        prompt_lang
+        TRANSCRIBE_PROMPTS.get(lang, TRANSCRIBE_PROMPTS["EN"]),
     ]
     try:
-        response = await gemini_client.aio.models.generate_content(
-            model=model_name,
-            contents=contents
+        response = await asyncio.wait_for(
+            generate_with_fallback(
+                "transcribe_audio",
+                models,
+                lambda model_name: gemini_client.aio.models.generate_content(model=model_name, contents=contents, config=TRANSCRIBE_CONFIG),
+                # Transcription is cheap text output, so it is worth hedging against a slow model
+                hedge_delay=GEMINI_HEDGE_DELAY,
+            ),
+            GEMINI_REQUEST_TIMEOUT,
         )
         if response.text:
             return response.text.strip()
         return None
     except APIError as e:
-        logging.error(f"Action: api_error | Type: transcribe_audio | Model: {model_name} | Error: {e.message}")
+        logging.error("Action: api_error | Type: transcribe_audio | Models: %s | Error: %s", models, e.message)
         await handle_genai_error(e, status_msg, lang)
         return None
+    except asyncio.TimeoutError:
+        logging.error("Action: api_timeout | Type: transcribe_audio | Models: %s | Timeout: %ss", models, GEMINI_REQUEST_TIMEOUT)
+        await status_msg.edit_text(t["ERR_AUDIO_TRANS"])
+        return None
     except Exception as e:
-        logging.error(f"Action: system_error | Type: transcribe_audio | Model: {model_name} | Error: {e}")
+        logging.error("Action: system_error | Type: transcribe_audio | Models: %s | Error: %s", models, e)
         await status_msg.edit_text(t["ERR_AUDIO_TRANS"])
         return None
 
@@ -385,33 +971,116 @@ async def transcribe_audio(audio_bytes: bytes, mode: str, status_msg: Message, l
 # ==========================================
 # INPUT DATA PROCESSING (TEXT/VOICE/PHOTO)
 # ==========================================
-async def process_text_or_voice_prompt(text: str, message: Message, bot: Bot, state: FSMContext, status_msg: Message | None = None):
+async def show_status(bot: Bot, message: Message, status_msg: Message | None, text: str) -> Message | None:
+    """
+    Sends (or updates) the status message together with the upload_photo chat action and returns the status message.
+    It runs while the model is already working, so it never raises: a status message Telegram refuses is replaced
+    by a fresh one, or dropped (None), instead of costing the result that is being generated.
+    """
+    chat_action = bot.send_chat_action(chat_id=message.chat.id, action="upload_photo")
+    if status_msg is not None:
+        edited, _ = await asyncio.gather(
+            bot.edit_message_text(text=text, chat_id=status_msg.chat.id, message_id=status_msg.message_id),
+            chat_action,
+            return_exceptions=True,
+        )
+        if not isinstance(edited, Exception):
+            return status_msg
+        logging.warning("Action: status_edit_failed | UserID: %s | Error: %s", message.from_user.id, edited)
+        try:
+            return await bot.send_message(chat_id=message.chat.id, text=text)
+        except Exception as e:
+            logging.warning("Action: status_send_failed | UserID: %s | Error: %s", message.from_user.id, e)
+            return None
+
+    sent, _ = await asyncio.gather(
+        bot.send_message(chat_id=message.chat.id, text=text),
+        chat_action,
+        return_exceptions=True,
+    )
+    if isinstance(sent, Exception):
+        logging.warning("Action: status_send_failed | UserID: %s | Error: %s", message.from_user.id, sent)
+        return None
+    return sent
+
+@asynccontextmanager
+async def keep_chat_action(bot: Bot, chat_id: int, action: str):
+    """Re-sends the chat action while the block runs: Telegram clears it after 5 seconds, long before an image is ready"""
+    async def refresh():
+        while True:
+            await asyncio.sleep(CHAT_ACTION_INTERVAL)
+            try:
+                await bot.send_chat_action(chat_id=chat_id, action=action)
+            except Exception as e:
+                # Purely cosmetic, so a failed refresh must never affect the request itself
+                logging.debug("Action: chat_action_failed | ChatID: %s | Error: %s", chat_id, e)
+
+    task = asyncio.create_task(refresh())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+async def send_result_photo(bot: Bot, message: Message, status_msg: Message | None, image_bytes: bytes, filename: str):
+    """Sends the finished image and deletes the status message (if there is one) concurrently, saving one Telegram round-trip"""
+    photo = bot.send_photo(chat_id=message.chat.id, photo=types.BufferedInputFile(image_bytes, filename=filename))
+    if status_msg is None:
+        await photo
+        return
+    sent, deleted = await asyncio.gather(
+        photo,
+        bot.delete_message(chat_id=status_msg.chat.id, message_id=status_msg.message_id),
+        return_exceptions=True,
+    )
+    # A status message that cannot be deleted (e.g. already removed) must not fail the delivered result
+    if isinstance(deleted, Exception):
+        logging.warning("Action: status_delete_failed | UserID: %s | Error: %s", message.from_user.id, deleted)
+    if isinstance(sent, Exception):
+        raise sent
+
+async def report_delivery_failure(bot: Bot, message: Message, text: str):
+    """Reports a result that could not be sent: the status message is deleted alongside the upload, so a new message is used"""
+    try:
+        await bot.send_message(chat_id=message.chat.id, text=text)
+    except Exception as e:
+        logging.warning("Action: status_report_failed | UserID: %s | Error: %s", message.from_user.id, e)
+
+async def process_text_or_voice_prompt(text: str, message: Message, bot: Bot, state: FSMContext, current_state: str | None, data: dict, status_msg: Message | None = None):
     """
     Unified logic for processing finalized text text details:
     Accepts ready text (whether typed or transcribed from voice) and routes it to the appropriate API function.
     """
-    current_state = await state.get_state()
-    data = await state.get_data()
     mode = data.get("mode", "FLASH")
     lang = data.get("lang", "EN")
     t = TEXTS[lang]
     
     # Image Generation Flow
     if current_state == BotStates.WAITING_FOR_IMAGE_PROMPT.state:
-        logging.info(f"Action: start_art_generation | UserID: {message.from_user.id} | Prompt: {text}")
-        if not status_msg:
-            status_msg = await message.answer(t["PROCESS_GEN_START"])
-        else:
-            await status_msg.edit_text(t["PROCESS_GEN_START"])
-            
-        await bot.send_chat_action(chat_id=message.chat.id, action="upload_photo")
-        image_bytes = await generate_image_from_text(text, mode, status_msg, lang)
+        logging.info("Action: start_art_generation | UserID: %s | Prompt: %s", message.from_user.id, text)
+        # The status message goes out while the model is already working instead of delaying the request
+        status_task = asyncio.create_task(show_status(bot, message, status_msg, t["PROCESS_GEN_START"]))
+        try:
+            async with keep_chat_action(bot, message.chat.id, "upload_photo"), gemini_slot(message.from_user.id):
+                image_bytes = await generate_image_from_text(message.from_user.id, text, mode, status_task, lang)
+        except BaseException:
+            # The handler is being cancelled: do not leave the status update running on its own
+            status_task.cancel()
+            raise
+        status_msg = await status_task
         
         if image_bytes:
-            await message.answer_photo(types.BufferedInputFile(image_bytes, filename="art.jpg"))
-            await state.set_state(None)
-            await status_msg.delete()
-            logging.info(f"Action: success_art | UserID: {message.from_user.id}")
+            try:
+                await send_result_photo(bot, message, status_msg, image_bytes, "art.jpg")
+            except Exception as e:
+                logging.error("Action: error_send_art | UserID: %s | Error: %s", message.from_user.id, e)
+                await report_delivery_failure(bot, message, t["ERR_GEN_INTERNAL"])
+                return
+            try:
+                await state.set_state(None)
+            except Exception as e:
+                # The image is already delivered; a stale state only means the next text is taken as a new prompt
+                logging.error("Action: error_save_state | UserID: %s | Error: %s", message.from_user.id, e)
+            logging.info("Action: success_art | UserID: %s", message.from_user.id)
         
     # Image Editing Flow
     elif current_state == BotStates.WAITING_FOR_EDIT_PROMPT.state:
@@ -425,33 +1094,47 @@ async def process_text_or_voice_prompt(text: str, message: Message, bot: Bot, st
             await state.set_state(None)
             return
 
-        logging.info(f"Action: start_edit_generation | UserID: {message.from_user.id} | Prompt: {text}")
+        logging.info("Action: start_edit_generation | UserID: %s | Prompt: %s", message.from_user.id, text)
 
         if not status_msg:
             status_msg = await message.answer(t["PROCESS_EDIT_PREP"])
         else:
             await status_msg.edit_text(t["PROCESS_EDIT_PREP"])
             
-        # Download the photo just in time right before API request to save memory footprint
+        # The photo is normally prefetched on upload; otherwise it is downloaded here, right before the API request
         try:
-            file = await bot.get_file(edit_file_id)
-            downloaded_file = await bot.download_file(file.file_path)
-            image_bytes = downloaded_file.read()
-            
-            await status_msg.edit_text(t["PROCESS_EDIT_GEN"])
-            await bot.send_chat_action(chat_id=message.chat.id, action="upload_photo")
-            
-            edited_image_bytes = await edit_image_with_prompt(image_bytes, text, mode, status_msg, lang)
-            
-            if edited_image_bytes:
-                await message.answer_photo(types.BufferedInputFile(edited_image_bytes, filename="edited.jpg"))
-                await state.set_state(None)
-                await state.update_data(edit_photo_file_id=None)
-                await status_msg.delete()
-                logging.info(f"Action: success_edit | UserID: {message.from_user.id}")
+            image_bytes = await get_edit_photo(bot, edit_file_id)
         except Exception as e:
-            logging.error(f"Action: error_download_edit | UserID: {message.from_user.id} | Error: {e}")
+            logging.error("Action: error_download_edit | UserID: %s | Error: %s", message.from_user.id, e)
             await status_msg.edit_text(t["ERR_DL_TELEGRAM"])
+            return
+
+        status_task = asyncio.create_task(show_status(bot, message, status_msg, t["PROCESS_EDIT_GEN"]))
+        try:
+            async with keep_chat_action(bot, message.chat.id, "upload_photo"), gemini_slot(message.from_user.id):
+                edited_image_bytes = await edit_image_with_prompt(message.from_user.id, image_bytes, text, mode, status_task, lang)
+        except BaseException:
+            status_task.cancel()
+            raise
+        status_msg = await status_task
+
+        if edited_image_bytes:
+            try:
+                await send_result_photo(bot, message, status_msg, edited_image_bytes, "edited.jpg")
+            except Exception as e:
+                logging.error("Action: error_send_edit | UserID: %s | Error: %s", message.from_user.id, e)
+                await report_delivery_failure(bot, message, t["ERR_DL_TELEGRAM"])
+                return
+            try:
+                # Re-read the data so mode/language switches made during generation are kept
+                data = await state.get_data()
+                data.pop("edit_photo_file_id", None)
+                await save_state(state, None, data)
+            except Exception as e:
+                # The edit is already delivered; a failed state write must not turn it into an error for the user
+                logging.error("Action: error_save_state | UserID: %s | Error: %s", message.from_user.id, e)
+            PHOTO_CACHE.pop(edit_file_id, None)
+            logging.info("Action: success_edit | UserID: %s", message.from_user.id)
 
     # Prevent submitting text when the bot expects a photo upload
     elif current_state == BotStates.WAITING_FOR_PHOTO_TO_EDIT.state:
@@ -471,16 +1154,32 @@ async def process_text_or_voice_prompt(text: str, message: Message, bot: Bot, st
 
 
 @dp.message(F.text & ~F.text.startswith("/"))
-async def handle_user_text(message: Message, bot: Bot, state: FSMContext):
+async def handle_user_text(message: Message, bot: Bot, state: FSMContext, raw_state: str | None, fsm_data: dict):
     """Route regular text directly to the unified processing function"""
-    await process_text_or_voice_prompt(message.text, message, bot, state)
+    # Menu buttons are dispatched earlier in any state, but the language keyboard only is while choosing a language:
+    # a tap on a stale language keyboard would otherwise be sent to Gemini as an image prompt
+    if message.text in LANG_OPTION_TEXTS:
+        await handle_language_selection(message, state, fsm_data)
+        return
+    await process_text_or_voice_prompt(message.text, message, bot, state, raw_state, fsm_data)
+
+async def send_transcription(bot: Bot, chat_id: int, text: str, lang: str):
+    """
+    Echoes a transcription back to the user, split into several messages if it exceeds Telegram's length limit.
+    The echo is informational and runs next to the prompt request, so it never raises.
+    """
+    t = TEXTS[lang]
+    try:
+        for index, chunk in enumerate(split_message(text)):
+            safe_chunk = format_html_response(chunk)
+            await bot.send_message(chat_id=chat_id, text=t["TXT_TRANSCRIBED"].format(text=safe_chunk) if index == 0 else safe_chunk)
+    except Exception as e:
+        logging.warning("Action: transcription_echo_failed | ChatID: %s | Error: %s", chat_id, e)
 
 @dp.message(F.voice)
-async def handle_user_voice(message: Message, bot: Bot, state: FSMContext):
+async def handle_user_voice(message: Message, bot: Bot, state: FSMContext, raw_state: str | None, fsm_data: dict, lang: str, mode: str):
     """Voice handler: downloads voice, transcribes it, and routes to unified logic"""
-    current_state = await state.get_state()
-    data = await state.get_data()
-    lang = data.get("lang", "EN")
+    current_state = raw_state
     t = TEXTS[lang]
 
     # Prevent trying to describe a photo using voice when waiting for photo upload
@@ -493,47 +1192,44 @@ async def handle_user_voice(message: Message, bot: Bot, state: FSMContext):
         await message.answer(t["ERR_MENU_FIRST"])
         return
 
-    logging.info(f"Action: receive_voice | UserID: {message.from_user.id}")
+    logging.info("Action: receive_voice | UserID: %s", message.from_user.id)
     status_msg = await message.answer(t["PROCESS_VOICE_RX"])
     await bot.send_chat_action(chat_id=message.chat.id, action="typing")
     
     try:
-        file_id = message.voice.file_id
-        file = await bot.get_file(file_id)
-        downloaded_file = await bot.download_file(file.file_path)
-        audio_bytes = downloaded_file.read()
-
-        mode = data.get("mode", "FLASH")
-        
+        audio_bytes = await download_telegram_file(bot, message.voice.file_id)
         await status_msg.edit_text(t["PROCESS_VOICE_TRANS"])
+    except Exception as e:
+        logging.error("Action: error_voice_handling | UserID: %s | Error: %s", message.from_user.id, e)
+        await report_status(status_msg, t["ERR_VOICE_DL"])
+        return
+
+    async with gemini_slot(message.from_user.id):
         text = await transcribe_audio(audio_bytes, mode, status_msg, lang)
 
-        if text:
-            # Display safely encoded transcription copy for validation
-            safe_text = format_html_response(text)
-            await message.answer(t["TXT_TRANSCRIBED"].format(text=safe_text))
-            await process_text_or_voice_prompt(text, message, bot, state, status_msg)
-            
-    except Exception as e:
-        logging.error(f"Action: error_voice_handling | UserID: {message.from_user.id} | Error: {e}")
-        await status_msg.edit_text(t["ERR_VOICE_DL"])
+    if text:
+        # Display safely encoded transcription copy for validation while the prompt is already being processed.
+        # The prompt flow reports its own errors in the status message, so they are kept apart from voice download errors
+        await asyncio.gather(
+            send_transcription(bot, message.chat.id, text, lang),
+            process_text_or_voice_prompt(text, message, bot, state, current_state, fsm_data, status_msg),
+        )
 
 @dp.message(F.photo)
-async def handle_user_photo(message: Message, bot: Bot, state: FSMContext):
+async def handle_user_photo(message: Message, bot: Bot, state: FSMContext, raw_state: str | None, fsm_data: dict, lang: str):
     """Processes newly uploaded photos"""
-    current_state = await state.get_state()
-    data = await state.get_data()
-    lang = data.get("lang", "EN")
+    current_state = raw_state
     t = TEXTS[lang]
     
     # State matches the Edit photo intention
     if current_state == BotStates.WAITING_FOR_PHOTO_TO_EDIT.state:
-        file_id = message.photo[-1].file_id
+        file_id = pick_photo_size(message.photo).file_id
         
         # We only save file_id within Redis/In-Memory contexts to prevent state overflow
-        await state.update_data(edit_photo_file_id=file_id)
-        await state.set_state(BotStates.WAITING_FOR_EDIT_PROMPT)
-        logging.info(f"Action: receive_photo_for_edit | UserID: {message.from_user.id}")
+        fsm_data["edit_photo_file_id"] = file_id
+        await save_state(state, BotStates.WAITING_FOR_EDIT_PROMPT, fsm_data)
+        start_photo_prefetch(bot, file_id)
+        logging.info("Action: receive_photo_for_edit | UserID: %s", message.from_user.id)
         
         await message.answer(t["PHOTO_LOADED_PROMPT"])
         
@@ -550,10 +1246,8 @@ async def handle_user_photo(message: Message, bot: Bot, state: FSMContext):
         await message.answer(t["ERR_PHOTO_NO_MENU"])
 
 @dp.message()
-async def handle_other_media(message: Message, state: FSMContext):
+async def handle_other_media(message: Message, lang: str):
     """Fallback handler for unsupported documents: files, stickers, videos"""
-    data = await state.get_data()
-    lang = data.get("lang", "EN")
     t = TEXTS[lang]
     await message.answer(t["ERR_UNSUPPORTED_MEDIA"])
 
@@ -561,10 +1255,31 @@ async def handle_other_media(message: Message, state: FSMContext):
 # ==========================================
 # ENTRYPOINT AND BOOTSTRAPPING
 # ==========================================
+@dp.startup()
+async def on_startup(bot: Bot):
+    """Warms up the Telegram and Gemini connection pools so the first user request skips the TLS handshake"""
+    results = await asyncio.gather(
+        bot.get_me(),
+        gemini_client.aio.models.list(config={"page_size": 1}),
+        return_exceptions=True,
+    )
+    for target, result in zip(("telegram", "gemini"), results):
+        if isinstance(result, Exception):
+            logging.warning("Action: warmup_failed | Target: %s | Error: %s", target, result)
+
+@dp.shutdown()
+async def on_shutdown(bot: Bot):
+    """Drains the shared Telegram, Gemini and Redis connection pools"""
+    await bot.session.close()
+    await gemini_client.aio.aclose()
+    await gemini_http_client.aclose()
+    if redis_client:
+        await redis_client.aclose()
+
 async def main():
     """Main function bootstraps aiogram configuring Webhooks or Long Polling"""
     if WEBHOOK_URL:
-        logging.info(f"Starting bot through Webhook on port {PORT}")
+        logging.info("Starting bot through Webhook on port %s", PORT)
         app = web.Application()
         # Secret tokens for Telegram verification tolerate strictly A-Z, a-z, 0-9, _, and -
         webhook_secret = TELEGRAM_BOT_TOKEN.replace(":", "")
@@ -578,9 +1293,10 @@ async def main():
         
         await bot.set_webhook(f"{WEBHOOK_URL}/webhook", secret_token=webhook_secret)
         
+        # No per-request access log: Telegram's webhook calls would otherwise log a line for every update
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
         try:
-            runner = web.AppRunner(app)
-            await runner.setup()
             site = web.TCPSite(runner, host="0.0.0.0", port=PORT)
             await site.start()
             
@@ -588,19 +1304,19 @@ async def main():
             while True:
                 await asyncio.sleep(3600)
         finally:
-            if redis_client:
-                await redis_client.aclose()
+            # Runs the app's on_shutdown hooks, which emit the dispatcher shutdown
+            await runner.cleanup()
     else:
         logging.info("Initializing local long polling...")
         await bot.delete_webhook(drop_pending_updates=True) # Cleans up stalled webhook bindings safely
-        try:
-            await dp.start_polling(bot)
-        finally:
-            if redis_client:
-                await redis_client.aclose()
+        # Polling emits the dispatcher shutdown on exit
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logging.info("Bot successfully stopped by administrator.")
@@ -10,21 +10,36 @@ class AppConfig:
     webhook_url: str | None
     port: int
     redis_url: str | None
+    gemini_max_concurrency: int
+    user_max_concurrency: int
+    log_level: str
+    image_cache_size: int
+    image_cache_ttl: int
+    gemini_hedge_delay: float
+    fsm_ttl: int
+    gemini_retry_attempts: int
+    gemini_retry_base_delay: float
+    gemini_retry_max_delay: float
+    gemini_retry_jitter: float
+    gemini_model_rpm: int
+    gemini_request_timeout: float
+    gemini_image_hedge_delay: float | None
+    edit_photo_max_side: int
 
 
 IMAGE_GEN_MODELS = {
-    "PRO": ["gemini-3-pro-image-preview"],
-    "FLASH": ["gemini-3.1-flash-image-preview"],
+    "PRO": ("gemini-3-pro-image-preview",),
+    "FLASH": ("gemini-3.1-flash-image-preview",),
 }
 
 IMAGE_EDIT_MODELS = {
-    "PRO": ["gemini-3-pro-image-preview"],
-    "FLASH": ["gemini-3.1-flash-image-preview"],
+    "PRO": ("gemini-3-pro-image-preview",),
+    "FLASH": ("gemini-3.1-flash-image-preview",),
 }
 
 TEXT_AUDIO_MODELS = {
-    "PRO": ["gemini-3-flash-preview"],
-    "FLASH": ["gemini-3-flash-preview"],
+    "PRO": ("gemini-3-flash-preview",),
+    "FLASH": ("gemini-3-flash-preview",),
 }
 
 
@@ -36,4 +51,19 @@ def load_config() -> AppConfig:
         webhook_url=os.getenv("WEBHOOK_URL"),
         port=int(os.getenv("PORT", 8080)),
         redis_url=os.getenv("REDIS_URL"),
+        gemini_max_concurrency=max(1, int(os.getenv("GEMINI_MAX_CONCURRENCY", 32))),
+        user_max_concurrency=max(1, int(os.getenv("USER_MAX_CONCURRENCY", 2))),
+        log_level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        image_cache_size=int(os.getenv("IMAGE_CACHE_SIZE", 0)),
+        image_cache_ttl=int(os.getenv("IMAGE_CACHE_TTL", 3600)),
+        gemini_hedge_delay=float(os.getenv("GEMINI_HEDGE_DELAY", 2.0)),
+        fsm_ttl=int(os.getenv("FSM_TTL", 30 * 24 * 3600)),
+        gemini_retry_attempts=max(1, int(os.getenv("GEMINI_RETRY_ATTEMPTS", 2))),
+        gemini_retry_base_delay=float(os.getenv("GEMINI_RETRY_BASE_DELAY", 0.5)),
+        gemini_retry_max_delay=float(os.getenv("GEMINI_RETRY_MAX_DELAY", 5.0)),
+        gemini_retry_jitter=float(os.getenv("GEMINI_RETRY_JITTER", 0.25)),
+        gemini_model_rpm=int(os.getenv("GEMINI_MODEL_RPM", 0)),
+        gemini_request_timeout=float(os.getenv("GEMINI_REQUEST_TIMEOUT", 120.0)),
+        gemini_image_hedge_delay=float(os.environ["GEMINI_IMAGE_HEDGE_DELAY"]) if os.getenv("GEMINI_IMAGE_HEDGE_DELAY") else None,
+        edit_photo_max_side=int(os.getenv("EDIT_PHOTO_MAX_SIDE", 1568)),
     )
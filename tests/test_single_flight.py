@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+import unittest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        bot.IN_FLIGHT_REQUESTS.clear()
+        bot.IN_FLIGHT_WAITERS.clear()
+
+    async def test_concurrent_callers_share_one_call(self):
+        calls = 0
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "image"
+
+        results = await asyncio.gather(*(bot.single_flight("key", call) for _ in range(3)))
+        self.assertEqual(results, ["image"] * 3)
+        self.assertEqual(calls, 1)
+        self.assertEqual(bot.IN_FLIGHT_REQUESTS, {})
+
+    async def test_retry_after_cancel_starts_a_new_call(self):
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        async def fast():
+            return "image"
+
+        waiter = asyncio.create_task(bot.single_flight("key", slow))
+        await started.wait()
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+        # The cancelled request is still finishing, but a retry must not join it
+        self.assertEqual(await bot.single_flight("key", fast), "image")
+        await asyncio.sleep(0)
+        self.assertEqual(bot.IN_FLIGHT_REQUESTS, {})
+        self.assertEqual(bot.IN_FLIGHT_WAITERS, {})
+
+    async def test_old_task_does_not_unregister_its_replacement(self):
+        old_release = asyncio.Event()
+        new_release = asyncio.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            finally:
+                # Keeps the cancelled task running until the replacement is registered
+                await old_release.wait()
+
+        async def blocked():
+            await new_release.wait()
+            return "image"
+
+        waiter = asyncio.create_task(bot.single_flight("key", slow))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+
+        retry = asyncio.create_task(bot.single_flight("key", blocked))
+        await asyncio.sleep(0)
+        replacement = bot.IN_FLIGHT_REQUESTS["key"]
+
+        # The cancelled task finishing must leave the replacement registered for new callers
+        old_release.set()
+        await asyncio.sleep(0.01)
+        self.assertIs(bot.IN_FLIGHT_REQUESTS.get("key"), replacement)
+
+        new_release.set()
+        self.assertEqual(await retry, "image")
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,7 +17,7 @@ TEXTS = {
         "ERR_SAFETY": "⚠️ Error: The request was rejected by safety filters. Please try rephrasing your prompt.",
         "ERR_RATELIMIT": "⏳ Rate limit exceeded. We've sent too many commands. Please wait a minute.",
         "ERR_SERVER": "🔌 Google Gemini servers are temporarily unavailable. Please try again later.",
-        "ERR_UNKNOWN": "⚙️ An unknown error occurred: {error}. Please try again.",
+        "ERR_UNKNOWN": "⚙️ An unknown error occurred: <code>{error}</code>. Please try again.",
         "ERR_GEN_INTERNAL": "😔 An internal error occurred in the generation service. Please try again later.",
         "ERR_EDIT_INTERNAL": "😔 The editing service is unavailable. Please try your operation again later.",
         "ERR_AUDIO_TRANS": "⚠️ Could not transcribe the voice message. Please try writing your request in text.",
@@ -57,7 +57,7 @@ TEXTS = {
         "ERR_SAFETY": "⚠️ Ошибка: Запрос отклонён фильтрами безопасности. Попробуйте изменить формулировку.",
         "ERR_RATELIMIT": "⏳ Превышен лимит запросов. Мы отправили слишком много команд. Пожалуйста, подождите минуту.",
         "ERR_SERVER": "🔌 Серверы Google Gemini временно недоступны. Пожалуйста, попробуйте запрос позже.",
-        "ERR_UNKNOWN": "⚙️ Произошла неизвестная ошибка при обращении к API: {error}. Попробуйте ещё раз.",
+        "ERR_UNKNOWN": "⚙️ Произошла неизвестная ошибка при обращении к API: <code>{error}</code>. Попробуйте ещё раз.",
         "ERR_GEN_INTERNAL": "😔 Произошел внутренний сбой сервиса генерации. Попробуйте снова чуть позже.",
         "ERR_EDIT_INTERNAL": "😔 Сервис редактирования недоступен. Попробуйте повторить операцию позднее.",
         "ERR_AUDIO_TRANS": "⚠️ Не удалось распознать голосовое сообщение. Пожалуйста, попробуйте написать текстом.",